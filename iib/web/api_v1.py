@@ -1,16 +1,19 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 import copy
 import os
+import time
 from datetime import datetime
+from itertools import repeat
 
 import flask
 import kombu
 from flask_login import current_user, login_required
+from flask_sqlalchemy import BaseQuery
 from sqlalchemy.orm import with_polymorphic
 from sqlalchemy.sql import text
 from sqlalchemy import or_
 from werkzeug.exceptions import Forbidden, Gone, NotFound
-from typing import Any, cast, Dict, List, Optional, Tuple, Union
+from typing import Any, cast, Dict, Iterator, List, Optional, Tuple, Union
 
 from iib.exceptions import IIBError, ValidationError
 from iib.web import db, messaging
@@ -36,7 +39,13 @@ from iib.web.models import (
 )
 from iib.web.s3_utils import get_object_from_s3_bucket
 from botocore.response import StreamingBody
-from iib.web.utils import pagination_metadata, str_to_bool
+from iib.web.utils import (
+    keyset_pagination_metadata,
+    LRUCache,
+    paginate_without_count,
+    pagination_metadata,
+    str_to_bool,
+)
 from iib.workers.tasks.build import (
     handle_add_request,
     handle_rm_request,
@@ -47,13 +56,16 @@ from iib.workers.tasks.build_recursive_related_bundles import (
 from iib.workers.tasks.build_regenerate_bundle import handle_regenerate_bundle_request
 from iib.workers.tasks.build_merge_index_image import handle_merge_request
 from iib.workers.tasks.build_create_empty_index import handle_create_empty_index_request
+from iib.workers.tasks.celery import app as celery_app
 from iib.workers.tasks.general import failed_request_callback
 from iib.web.iib_static_types import (
     AddRequestPayload,
     AddRmBatchPayload,
     CreateEmptyIndexPayload,
     FbcOperationRequestPayload,
+    KeysetPaginationMetadata,
     MergeIndexImagesPayload,
+    PaginationMetadata,
     PayloadTypesUnion,
     RecursiveRelatedBundlesRequestPayload,
     RegenerateBundleBatchPayload,
@@ -63,6 +75,20 @@ from iib.web.iib_static_types import (
 
 api_v1 = flask.Blueprint('api_v1', __name__)
 
+# The positions of the secrets in the arguments generated by _get_add_args and _get_rm_args
+_ADD_ARGS_SECRET_POSITIONS: Tuple[int, ...] = (5, 9)
+_RM_ARGS_SECRET_POSITIONS: Tuple[int, ...] = (6,)
+# The timestamps of the final states of recently retrieved requests. This avoids querying the
+# database every time the logs of a finalized request are polled. The cache is per process, so a
+# PATCH of the state only invalidates the entry in the process that handled it. The other processes
+# keep the previous timestamp until the entry is evicted.
+_finalized_request_cache = LRUCache(maxsize=4096)
+# The number of requests queried at a time when streaming the build requests
+_STREAM_CHUNK_SIZE = 100
+# The number of seconds a successful health check is reused for, and when it last happened
+_HEALTHCHECK_CACHE_SECONDS = 1
+_last_successful_healthcheck = float('-inf')
+
 
 def _get_rm_args(
     payload: RmRequestPayload,
@@ -108,6 +134,7 @@ def _get_add_args(
     :return: List with add arguments
     :rtype: list
     """
+    conf = flask.current_app.config
     return [
         payload.get('bundles', []),
         request.id,
@@ -120,8 +147,8 @@ def _get_add_args(
         overwrite_from_index,
         payload.get('overwrite_from_index_token'),
         request.distribution_scope,
-        flask.current_app.config['IIB_GREENWAVE_CONFIG'].get(celery_queue),
-        flask.current_app.config['IIB_BINARY_IMAGE_CONFIG'],
+        conf['IIB_GREENWAVE_CONFIG'].get(celery_queue),
+        conf['IIB_BINARY_IMAGE_CONFIG'],
         payload.get('deprecation_list', []),
         payload.get('build_tags', []),
     ]
@@ -139,7 +166,7 @@ def _get_safe_args(
     :return: List with safe to print arguments
     :rtype: list
     """
-    safe_args = copy.copy(args)
+    safe_args = list(args)
 
     if payload.get('cnr_token'):
         safe_args[safe_args.index(payload['cnr_token'])] = '*****'  # type: ignore
@@ -155,6 +182,23 @@ def _get_safe_args(
     return safe_args
 
 
+def _mask_args(args: List[Any], positions: Tuple[int, ...]) -> List[Any]:
+    """
+    Generate arguments that are safe to print by masking the secrets at the given positions.
+
+    :param list args: arguments for the api, that are not safe
+    :param tuple positions: the indexes of the arguments which contain secrets
+    :return: List with safe to print arguments
+    :rtype: list
+    """
+    safe_args = list(args)
+    for position in positions:
+        if safe_args[position]:
+            safe_args[position] = '*****'
+
+    return safe_args
+
+
 def get_artifact_file_from_s3_bucket(
     s3_key_prefix: str,
     s3_file_name: str,
@@ -186,6 +230,45 @@ def get_artifact_file_from_s3_bucket(
     raise NotFound()
 
 
+def _stream_file(file_path: str, chunk_size: int = 65536) -> Iterator[bytes]:
+    """
+    Yield the content of a file in chunks.
+
+    This avoids reading large files, such as the request logs, fully into memory.
+
+    :param str file_path: the path to the file to read
+    :param int chunk_size: the maximum number of bytes to yield at a time
+    :return: a generator of the file content
+    :rtype: Iterator[bytes]
+    """
+    with open(file_path, 'rb') as f:
+        yield from iter(lambda: f.read(chunk_size), b'')
+
+
+def _stream_requests(query: BaseQuery, verbose: bool, limit: int) -> Iterator[str]:
+    """
+    Serialize the requests of the query as newline delimited JSON.
+
+    The requests are queried in chunks, so only a chunk of requests is in memory at a time.
+
+    :param flask_sqlalchemy.BaseQuery query: the query of the requests ordered by descending ID
+    :param bool verbose: if the verbose JSON representation of the requests should be used
+    :param int limit: the maximum number of requests to serialize
+    :return: an iterator over the JSON representation of each request followed by a newline
+    :rtype: Iterator[str]
+    """
+    requests = query.limit(min(limit, _STREAM_CHUNK_SIZE)).all()
+    while requests:
+        for request in requests:
+            yield flask.json.dumps(request.to_json(verbose=verbose)) + '\n'
+        limit -= len(requests)
+        if limit <= 0:
+            break
+        requests = (
+            query.filter(Request.id < requests[-1].id).limit(min(limit, _STREAM_CHUNK_SIZE)).all()
+        )
+
+
 def _get_unique_bundles(bundles: List[str]) -> List[str]:
     """
     Return list with unique bundles.
@@ -205,7 +288,7 @@ def _get_unique_bundles(bundles: List[str]) -> List[str]:
     unique_bundles = list(dict.fromkeys(bundles).keys())
 
     if len(unique_bundles) != len(bundles):
-        duplicate_bundles = copy.copy(bundles)
+        duplicate_bundles = list(bundles)
         for bundle in unique_bundles:
             duplicate_bundles.remove(bundle)
 
@@ -226,8 +309,10 @@ def get_build(request_id: int) -> flask.Response:
     """
     # Create an alias class to load the polymorphic classes
     poly_request = with_polymorphic(Request, '*')
-    query = poly_request.query.options(*get_request_query_options(verbose=True))
-    return flask.jsonify(query.get_or_404(request_id).to_json())
+    query = db.session.query(poly_request).options(
+        *get_request_query_options(poly_request, verbose=True)
+    )
+    return flask.jsonify(query.filter(Request.id == request_id).first_or_404().to_json())
 
 
 @api_v1.route('/builds/<int:request_id>/logs')
@@ -241,19 +326,37 @@ def get_build_logs(request_id: int) -> flask.Response:
     :raise Gone: if the logs for the build request have been removed due to expiration
     :raise ValidationError: if the request has not completed yet
     """
-    request_log_dir = flask.current_app.config['IIB_REQUEST_LOGS_DIR']
-    s3_bucket_name = flask.current_app.config['IIB_AWS_S3_BUCKET_NAME']
+    conf = flask.current_app.config
+    request_log_dir = conf['IIB_REQUEST_LOGS_DIR']
+    s3_bucket_name = conf['IIB_AWS_S3_BUCKET_NAME']
     if not s3_bucket_name and not request_log_dir:
         raise NotFound()
 
-    request = Request.query.get_or_404(request_id)
+    state_updated = _finalized_request_cache.get(request_id)
+    if not state_updated:
+        # Only query the latest state of the request since that's all that is needed
+        request_state = (
+            db.session.query(RequestState.state, RequestState.updated)
+            .select_from(Request)
+            .join(Request.state)
+            .filter(Request.id == request_id)
+            .first()
+        )
+        if not request_state:
+            raise NotFound()
 
-    finalized = request.state.state_name in RequestStateMapping.get_final_states()
-    if not finalized:
-        raise ValidationError(
-            f'The request {request_id} is not complete yet.'
-            ' logs will be available once the request is complete.'
+        finalized = (
+            RequestStateMapping(request_state.state).name in RequestStateMapping.get_final_states()
         )
+        if not finalized:
+            raise ValidationError(
+                f'The request {request_id} is not complete yet.'
+                ' logs will be available once the request is complete.'
+            )
+        state_updated = request_state.updated
+        _finalized_request_cache.set(request_id, state_updated)
+
+    temporary_data_expiration = Request.get_temporary_data_expiration(state_updated)
 
     # If S3 bucket is configured, fetch the log file from the S3 bucket.
     # Else, check if logs are stored on the system itself and return them.
@@ -263,14 +366,17 @@ def get_build_logs(request_id: int) -> flask.Response:
             'request_logs',
             f'{request_id}.log',
             request_id,
-            request.temporary_data_expiration,
+            temporary_data_expiration,
             s3_bucket_name,
         )
         return flask.Response(log_file.read(), mimetype='text/plain')
 
     local_log_file_path = os.path.join(request_log_dir, f'{request_id}.log')
-    if not os.path.exists(local_log_file_path):
-        expired = request.temporary_data_expiration < datetime.utcnow()
+    try:
+        # A single stat call both checks if the file exists and gets its size
+        log_file_size = os.stat(local_log_file_path).st_size
+    except FileNotFoundError:
+        expired = temporary_data_expiration < datetime.utcnow()
         if expired:
             raise Gone(f'The logs for the build request {request_id} no longer exist')
         flask.current_app.logger.warning(
@@ -279,8 +385,20 @@ def get_build_logs(request_id: int) -> flask.Response:
         )
         raise IIBError('IIB is done processing the request and could not find logs.')
 
-    with open(local_log_file_path) as f:
-        return flask.Response(f.read(), mimetype='text/plain')
+    xsendfile_prefix = conf['IIB_LOG_XSENDFILE_PREFIX']
+    if xsendfile_prefix:
+        # Let the web server send the file instead of reading it through the application
+        return flask.Response(
+            mimetype='text/plain',
+            headers={'X-Accel-Redirect': f'{xsendfile_prefix.rstrip("/")}/{request_id}.log'},
+        )
+
+    return flask.Response(
+        _stream_file(local_log_file_path),
+        mimetype='text/plain',
+        headers={'Content-Length': log_file_size},
+        direct_passthrough=True,
+    )
 
 
 @api_v1.route('/builds/<int:request_id>/related_bundles')
@@ -294,8 +412,9 @@ def get_related_bundles(request_id: int) -> flask.Response:
     :raise Gone: if the related bundles for the build request have been removed due to expiration
     :raise ValidationError: if the request is of invalid type or is not completed yet
     """
-    request_related_bundles_dir = flask.current_app.config['IIB_REQUEST_RELATED_BUNDLES_DIR']
-    s3_bucket_name = flask.current_app.config['IIB_AWS_S3_BUCKET_NAME']
+    conf = flask.current_app.config
+    request_related_bundles_dir = conf['IIB_REQUEST_RELATED_BUNDLES_DIR']
+    s3_bucket_name = conf['IIB_AWS_S3_BUCKET_NAME']
     if not s3_bucket_name and not request_related_bundles_dir:
         raise NotFound()
 
@@ -354,9 +473,18 @@ def get_builds() -> flask.Response:
     """
     Retrieve the paginated build requests.
 
+    If the ``before`` query parameter is set, the build requests with a lower ID are returned using
+    keyset pagination instead of the page number based pagination. If the ``count`` query parameter
+    is false, the total number of build requests isn't counted. If the ``stream`` query parameter is
+    true, the build requests selected by the ``before`` and ``per_page`` query parameters are
+    streamed as newline delimited JSON. A stream may go past ``IIB_MAX_PER_PAGE`` up to
+    ``IIB_MAX_STREAMED_REQUESTS`` build requests, since they are queried in chunks.
+
     :rtype: flask.Response
+    :raise ValidationError: if the query parameters are invalid
     """
     batch_id: Optional[str] = flask.request.args.get('batch')
+    before = flask.request.args.get('before')
     state = flask.request.args.get('state')
     verbose = str_to_bool(flask.request.args.get('verbose'))
     max_per_page = flask.current_app.config['IIB_MAX_PER_PAGE']
@@ -368,12 +496,14 @@ def get_builds() -> flask.Response:
 
     # Create an alias class to load the polymorphic classes
     poly_request = with_polymorphic(Request, '*')
-    query = poly_request.query.options(*get_request_query_options(verbose=verbose))
+    query = db.session.query(poly_request).options(
+        *get_request_query_options(poly_request, verbose=verbose)
+    )
     if state:
         query_params['state'] = state
         RequestStateMapping.validate_state(state)
-        state_int = RequestStateMapping.__members__[state].value
-        query = query.join(Request.state)
+        state_int = RequestStateMapping[state].value
+        query = query.join(poly_request.state)
         query = query.filter(RequestState.state == state_int)
 
     if batch_id is not None:
@@ -392,39 +522,68 @@ def get_builds() -> flask.Response:
         # join with the user table and then filter on username
         # request table only has the user_id
         query_params['user'] = user
-        query = query.join(Request.user).filter(User.username == user)
+        query = query.join(poly_request.user).filter(User.username == user)
 
     if index_image:
         query_params['index_image'] = index_image
         # Get the image id of the image to be searched
         image_result = Image.query.filter_by(pull_specification=index_image).first()
         if image_result:
-            # join with the Request* tables to get the response as image_ids are stored there
-            query = (
-                query.outerjoin(RequestCreateEmptyIndex, Request.id == RequestCreateEmptyIndex.id)
-                .outerjoin(RequestAdd, Request.id == RequestAdd.id)
-                .outerjoin(RequestMergeIndexImage, Request.id == RequestMergeIndexImage.id)
-                .outerjoin(RequestRm, Request.id == RequestRm.id)
-            )
-
+            # The image_ids are stored in the Request* tables, which are already joined by the
+            # polymorphic entity
             query = query.filter(
                 or_(
-                    RequestCreateEmptyIndex.index_image_id == image_result.id,
-                    RequestAdd.index_image_id == image_result.id,
-                    RequestMergeIndexImage.index_image_id == image_result.id,
-                    RequestRm.index_image_id == image_result.id,
+                    poly_request.RequestCreateEmptyIndex.index_image_id == image_result.id,
+                    poly_request.RequestAdd.index_image_id == image_result.id,
+                    poly_request.RequestMergeIndexImage.index_image_id == image_result.id,
+                    poly_request.RequestRm.index_image_id == image_result.id,
                 )
             )
         # if index_image is not found in image table, then raise an error
         else:
             raise ValidationError(f'{index_image} is not a valid index image')
 
-    pagination_query = query.order_by(Request.id.desc()).paginate(max_per_page=max_per_page)
-    requests = pagination_query.items
+    query = query.order_by(Request.id.desc())
+    stream = str_to_bool(flask.request.args.get('stream'))
+    meta: Union[KeysetPaginationMetadata, PaginationMetadata]
+    if before is not None or stream:
+        error_msg = 'The "before" and "per_page" parameters must be positive integers'
+        if stream:
+            max_per_page = flask.current_app.config['IIB_MAX_STREAMED_REQUESTS']
+        try:
+            before_id = int(before) if before is not None else None
+            per_page = int(flask.request.args.get('per_page', max_per_page))
+        except ValueError:
+            raise ValidationError(error_msg)
+        if (before_id is not None and before_id < 1) or per_page < 1:
+            raise ValidationError(error_msg)
+        per_page = min(per_page, max_per_page)
+        if before_id is not None:
+            query = query.filter(Request.id < before_id)
+
+        if stream:
+            return flask.Response(
+                flask.stream_with_context(_stream_requests(query, verbose, per_page)),
+                mimetype='application/x-ndjson',
+            )
+
+        # Fetch one more request than needed to know if there is a next page
+        requests = query.limit(per_page + 1).all()
+        has_next = len(requests) > per_page
+        requests = requests[:per_page]
+        meta = keyset_pagination_metadata(requests, per_page, has_next, **query_params)
+    else:
+        if str_to_bool(flask.request.args.get('count', 'true')):
+            pagination_query = query.paginate(max_per_page=max_per_page)
+        else:
+            query_params['count'] = 'false'
+            pagination_query = paginate_without_count(query, max_per_page)
+        requests = pagination_query.items
+        meta = pagination_metadata(pagination_query, **query_params)
 
     response = {
         'items': [request.to_json(verbose=verbose) for request in requests],
-        'meta': pagination_metadata(pagination_query, **query_params),
+        'meta': meta,
     }
     return flask.jsonify(response)
 
@@ -438,12 +597,17 @@ def get_healthcheck() -> flask.Response:
     :return: json object representing the health of IIB
     :raises IIBError: if the database connection fails
     """
-    # Test DB connection
-    try:
-        db.engine.execute(text('SELECT 1'))
-    except Exception:
-        flask.current_app.logger.exception('DB test failed.')
-        raise IIBError('Database health check failed.')
+    global _last_successful_healthcheck
+    # Orchestrators poll the health check frequently, so don't test the DB connection on every call
+    if time.monotonic() - _last_successful_healthcheck >= _HEALTHCHECK_CACHE_SECONDS:
+        # Test DB connection
+        try:
+            with db.engine.connect() as connection:
+                connection.scalar(text('SELECT 1'))
+        except Exception:
+            flask.current_app.logger.exception('DB test failed.')
+            raise IIBError('Database health check failed.')
+        _last_successful_healthcheck = time.monotonic()
 
     return flask.jsonify({'status': 'Health check OK'})
 
@@ -466,9 +630,10 @@ def _get_user_queue(serial: Optional[bool] = False) -> Optional[str]:
     else:
         labeled_username = f'PARALLEL:{username}'
 
-    queue = flask.current_app.config['IIB_USER_TO_QUEUE'].get(labeled_username)
+    user_to_queue = flask.current_app.config['IIB_USER_TO_QUEUE']
+    queue = user_to_queue.get(labeled_username)
     if not queue:
-        queue = flask.current_app.config['IIB_USER_TO_QUEUE'].get(username)
+        queue = user_to_queue.get(username)
     return queue
 
 
@@ -500,7 +665,7 @@ def add_bundles() -> Tuple[flask.Response, int]:
     overwrite_from_index = payload.get('overwrite_from_index', False)
     celery_queue = _get_user_queue(serial=overwrite_from_index)
     args = _get_add_args(payload, request, overwrite_from_index, celery_queue)
-    safe_args = _get_safe_args(args, payload)
+    safe_args = _mask_args(args, _ADD_ARGS_SECRET_POSITIONS)
     error_callback = failed_request_callback.s(request.id)
 
     try:
@@ -555,7 +720,8 @@ def patch_request(request_id: int) -> Tuple[flask.Response, int]:
             if not isinstance(value, dict):
                 raise ValidationError(exc_msg)
             for v in value.values():
-                if not isinstance(v, list) or any(not isinstance(s, str) for s in v):
+                # map runs the type checks in C, which matters for requests with many bundles
+                if not isinstance(v, list) or not all(map(isinstance, v, repeat(str))):
                     raise ValidationError(exc_msg)
         elif key == 'recursive_related_bundles':
             if not isinstance(value, list):
@@ -617,22 +783,24 @@ def patch_request(request_id: int) -> Tuple[flask.Response, int]:
         'source_from_index_resolved',
         'target_index_resolved',
     )
+    bundle_mapping = payload.get('bundle_mapping', {})
+    # Get all the images and operators at once instead of querying them one by one
+    images = Image.bulk_get_or_create(
+        [payload[key] for key in image_keys if key in payload]
+        + [bundle for bundles in bundle_mapping.values() for bundle in bundles]
+    )
     for key in image_keys:
-        if key not in payload:
-            continue
-        key_value = payload.get(key, None)
-        key_object = Image.get_or_create(key_value)
-        # SQLAlchemy will not add the object to the database if it's already present
-        setattr(request, key, key_object)
+        if key in payload:
+            # SQLAlchemy will not add the object to the database if it's already present
+            setattr(request, key, images[payload[key]])
 
     for arch in payload.get('arches', []):
         request.add_architecture(arch)
 
-    for operator, bundles in payload.get('bundle_mapping', {}).items():
-        operator_img = Operator.get_or_create(operator)
+    operators = Operator.bulk_get_or_create(bundle_mapping.keys())
+    for operator, bundles in bundle_mapping.items():
         for bundle in bundles:
-            bundle_img = Image.get_or_create(bundle)
-            bundle_img.operator = operator_img
+            images[bundle].operator = operators[operator]
 
     if 'distribution_scope' in payload:
         request.distribution_scope = payload['distribution_scope']
@@ -640,6 +808,9 @@ def patch_request(request_id: int) -> Tuple[flask.Response, int]:
     db.session.commit()
 
     if state_updated:
+        # This must happen after the commit, otherwise a concurrent poll of the logs could cache
+        # the previous state again
+        _finalized_request_cache.pop(request_id)
         messaging.send_message_for_state_change(request)
 
     if current_user.is_authenticated:
@@ -673,7 +844,7 @@ def rm_operators() -> Tuple[flask.Response, int]:
     overwrite_from_index = payload.get('overwrite_from_index', False)
 
     args = _get_rm_args(payload, request, overwrite_from_index)
-    safe_args = _get_safe_args(args, payload)
+    safe_args = _mask_args(args, _RM_ARGS_SECRET_POSITIONS)
 
     error_callback = failed_request_callback.s(request.id)
     try:
@@ -752,19 +923,19 @@ def regenerate_bundle_batch() -> Tuple[flask.Response, int]:
     requests = []
     # Iterate through all the build requests and verify that the requests are valid before
     # committing them and scheduling the tasks
-    for build_request in payload['build_requests']:
+    for i, build_request in enumerate(payload['build_requests']):
         try:
             request = RequestRegenerateBundle.from_json(build_request, batch)
         except ValidationError as e:
             # Rollback the transaction if any of the build requests are invalid
             db.session.rollback()
             raise ValidationError(
-                f'{str(e).rstrip(".")}. This occurred on the build request in '
-                f'index {payload["build_requests"].index(build_request)}.'
+                f'{str(e).rstrip(".")}. This occurred on the build request in index {i}.'
             )
-        db.session.add(request)
         requests.append(request)
 
+    # The requests are already in the session through their batch, this only makes it explicit
+    db.session.add_all(requests)
     db.session.commit()
     messaging.send_messages_for_new_batch_of_requests(requests)
 
@@ -774,25 +945,28 @@ def regenerate_bundle_batch() -> Tuple[flask.Response, int]:
     processed_request_ids = []
     build_and_requests = zip(payload['build_requests'], requests)
     try:
-        for build_request, request in build_and_requests:
-            args = [
-                build_request['from_bundle_image'],
-                build_request.get('organization'),
-                request.id,
-                build_request.get('registry_auths'),
-                build_request.get('bundle_replacements', dict()),
-            ]
-            safe_args = _get_safe_args(args, build_request)
-            error_callback = failed_request_callback.s(request.id)
-            handle_regenerate_bundle_request.apply_async(
-                args=args,
-                link_error=error_callback,
-                argsrepr=repr(safe_args),
-                queue=_get_user_queue(),
-            )
+        # Reuse the same broker connection and channel to send all the tasks of the batch
+        with celery_app.producer_pool.acquire(block=True) as producer:
+            for build_request, request in build_and_requests:
+                args = [
+                    build_request['from_bundle_image'],
+                    build_request.get('organization'),
+                    request.id,
+                    build_request.get('registry_auths'),
+                    build_request.get('bundle_replacements', dict()),
+                ]
+                safe_args = _get_safe_args(args, build_request)
+                error_callback = failed_request_callback.s(request.id)
+                handle_regenerate_bundle_request.apply_async(
+                    args=args,
+                    link_error=error_callback,
+                    argsrepr=repr(safe_args),
+                    queue=_get_user_queue(),
+                    producer=producer,
+                )
 
-            request_jsons.append(request.to_json())
-            processed_request_ids.append(str(request.id))
+                request_jsons.append(request.to_json())
+                processed_request_ids.append(str(request.id))
     except kombu.exceptions.OperationalError:
         unprocessed_requests = [r for r in requests if str(r.id) not in processed_request_ids]
         handle_broker_batch_error(unprocessed_requests)
@@ -825,7 +999,7 @@ def add_rm_batch() -> Tuple[flask.Response, int]:
     requests: List[Union[RequestAdd, RequestRm]] = []
     # Iterate through all the build requests and verify that the requests are valid before
     # committing them and scheduling the tasks
-    for build_request in payload['build_requests']:
+    for i, build_request in enumerate(payload['build_requests']):
         try:
             if build_request.get('operators'):
                 # Check for the validity of a RM request
@@ -841,12 +1015,12 @@ def add_rm_batch() -> Tuple[flask.Response, int]:
                 raise ValidationError('Build request is not a valid Add/Rm request.')
         except ValidationError as e:
             raise ValidationError(
-                f'{str(e).rstrip(".")}. This occurred on the build request in '
-                f'index {payload["build_requests"].index(build_request)}.'
+                f'{str(e).rstrip(".")}. This occurred on the build request in index {i}.'
             )
-        db.session.add(request)
         requests.append(request)
 
+    # The requests are already in the session through their batch, this only makes it explicit
+    db.session.add_all(requests)
     db.session.commit()
     messaging.send_messages_for_new_batch_of_requests(requests)
 
@@ -854,50 +1028,58 @@ def add_rm_batch() -> Tuple[flask.Response, int]:
     # This list will be used for the log message below and avoids the need of having to iterate
     # through the list of requests another time
     processed_request_ids = []
-    for build_request, request in zip(payload['build_requests'], requests):
-        request_jsons.append(request.to_json())
-
-        overwrite_from_index = build_request.get('overwrite_from_index', False)
-        celery_queue = _get_user_queue(serial=overwrite_from_index)
-        if isinstance(request, RequestAdd):
-            args: List[Any] = _get_add_args(
-                # cast Union[AddRequestPayload, RmRequestPayload] based on request variable
-                cast(AddRequestPayload, build_request),
-                request,
-                overwrite_from_index,
-                celery_queue,
-            )
-        elif isinstance(request, RequestRm):
-            args = _get_rm_args(
-                # cast Union[AddRequestPayload, RmRequestPayload] based on request variable
-                cast(RmRequestPayload, build_request),
-                request,
-                overwrite_from_index,
-            )
-
-        safe_args = _get_safe_args(args, build_request)
+    # Reuse the same broker connection and channel to send all the tasks of the batch
+    with celery_app.producer_pool.acquire(block=True) as producer:
+        for build_request, request in zip(payload['build_requests'], requests):
+            request_jsons.append(request.to_json())
 
-        error_callback = failed_request_callback.s(request.id)
-        try:
+            overwrite_from_index = build_request.get('overwrite_from_index', False)
+            celery_queue = _get_user_queue(serial=overwrite_from_index)
             if isinstance(request, RequestAdd):
-                handle_add_request.apply_async(
-                    args=args,
-                    link_error=error_callback,
-                    argsrepr=repr(safe_args),
-                    queue=celery_queue,
+                args: List[Any] = _get_add_args(
+                    # cast Union[AddRequestPayload, RmRequestPayload] based on request variable
+                    cast(AddRequestPayload, build_request),
+                    request,
+                    overwrite_from_index,
+                    celery_queue,
                 )
-            else:
-                handle_rm_request.apply_async(
-                    args=args,
-                    link_error=error_callback,
-                    argsrepr=repr(safe_args),
-                    queue=celery_queue,
+                secret_positions = _ADD_ARGS_SECRET_POSITIONS
+            elif isinstance(request, RequestRm):
+                args = _get_rm_args(
+                    # cast Union[AddRequestPayload, RmRequestPayload] based on request variable
+                    cast(RmRequestPayload, build_request),
+                    request,
+                    overwrite_from_index,
                 )
-        except kombu.exceptions.OperationalError:
-            unprocessed_requests = [r for r in requests if str(r.id) not in processed_request_ids]
-            handle_broker_batch_error(unprocessed_requests)
+                secret_positions = _RM_ARGS_SECRET_POSITIONS
 
-        processed_request_ids.append(str(request.id))
+            safe_args = _mask_args(args, secret_positions)
+
+            error_callback = failed_request_callback.s(request.id)
+            try:
+                if isinstance(request, RequestAdd):
+                    handle_add_request.apply_async(
+                        args=args,
+                        link_error=error_callback,
+                        argsrepr=repr(safe_args),
+                        queue=celery_queue,
+                        producer=producer,
+                    )
+                else:
+                    handle_rm_request.apply_async(
+                        args=args,
+                        link_error=error_callback,
+                        argsrepr=repr(safe_args),
+                        queue=celery_queue,
+                        producer=producer,
+                    )
+            except kombu.exceptions.OperationalError:
+                unprocessed_requests = [
+                    r for r in requests if str(r.id) not in processed_request_ids
+                ]
+                handle_broker_batch_error(unprocessed_requests)
+
+            processed_request_ids.append(str(request.id))
 
     flask.current_app.logger.debug(
         'Successfully scheduled the batch %d with requests: %s',
@@ -1050,10 +1232,9 @@ def get_nested_bundles(request_id: int) -> flask.Response:
     :raise Gone: if the related bundles for the build request have been removed due to expiration
     :raise ValidationError: if the request is of invalid type or is not completed yet
     """
-    recursive_related_bundles_dir = flask.current_app.config[
-        'IIB_REQUEST_RECURSIVE_RELATED_BUNDLES_DIR'
-    ]
-    s3_bucket_name = flask.current_app.config['IIB_AWS_S3_BUCKET_NAME']
+    conf = flask.current_app.config
+    recursive_related_bundles_dir = conf['IIB_REQUEST_RECURSIVE_RELATED_BUNDLES_DIR']
+    s3_bucket_name = conf['IIB_AWS_S3_BUCKET_NAME']
 
     request = Request.query.get_or_404(request_id)
     if request.type != RequestTypeMapping.recursive_related_bundles.value:
@@ -17,6 +17,7 @@ from iib.web.api_v1 import api_v1
 from iib.web.auth import user_loader, load_user_from_request
 from iib.web.docs import docs
 from iib.web.errors import json_error
+from iib.web.utils import IIBJSONEncoder
 
 # Import the models here so that Alembic will be guaranteed to detect them
 import iib.web.models  # noqa: F401
@@ -166,6 +167,7 @@ def create_app(config_obj: Optional[str] = None) -> Flask:  # pragma: no cover
     :rtype: flask.Flask
     """
     app = Flask(__name__)
+    app.json_encoder = IIBJSONEncoder
     if config_obj:
         app.config.from_object(config_obj)
     else:
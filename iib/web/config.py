@@ -17,7 +17,10 @@ class Config(object):
     IIB_LOG_FORMAT: str = '%(asctime)s %(name)s %(levelname)s %(module)s.%(funcName)s %(message)s'
     # This sets the level of the "flask.app" logger, which is accessed from current_app.logger
     IIB_LOG_LEVEL: str = 'INFO'
+    # The web server location prefix to offload sending the request logs to with X-Accel-Redirect
+    IIB_LOG_XSENDFILE_PREFIX: Optional[str] = None
     IIB_MAX_PER_PAGE: int = 20
+    IIB_MAX_STREAMED_REQUESTS: int = 10000
     IIB_MESSAGING_CA: str = '/etc/pki/tls/certs/ca-bundle.crt'
     IIB_MESSAGING_CERT: str = '/etc/iib/messaging.crt'
     IIB_MESSAGING_DURABLE: bool = True
@@ -29,6 +32,9 @@ class Config(object):
     IIB_REQUEST_RECURSIVE_RELATED_BUNDLES_DIR: Optional[str] = None
     IIB_USER_TO_QUEUE: Dict[str, str] = {}
     IIB_WORKER_USERNAMES: List[str] = []
+    # Avoid the indentation and key sorting overhead when serializing the API responses
+    JSON_SORT_KEYS: bool = False
+    JSONIFY_PRETTYPRINT_REGULAR: bool = False
     SQLALCHEMY_TRACK_MODIFICATIONS: bool = False
 
 
@@ -11,13 +11,21 @@ class PaginationMetadata(TypedDict):
     """Datastructure of the metadata about the paginated query."""
 
     first: str
-    last: str
+    last: NotRequired[str]
     next: Optional[str]
     page: int
-    pages: int
+    pages: NotRequired[int]
     per_page: int
     previous: Optional[str]
-    total: int
+    total: NotRequired[int]
+
+
+class KeysetPaginationMetadata(TypedDict):
+    """Datastructure of the metadata about the keyset paginated query."""
+
+    first: str
+    next: Optional[str]
+    per_page: int
 
 
 class AddressMessageEnvelope(NamedTuple):
@@ -0,0 +1,27 @@
+"""Replace the index on the batch of requests with a composite index on the batch and ID.
+
+Revision ID: 5db614d0b5ff
+Revises: 8d50f82f0be9
+Create Date: 2026-10-15 09:12:31.204518
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5db614d0b5ff'
+down_revision = '8d50f82f0be9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('request') as batch_op:
+        batch_op.create_index('ix_request_batch_id_id', ['batch_id', 'id'], unique=False)
+        batch_op.drop_index('ix_request_batch_id')
+
+
+def downgrade():
+    with op.batch_alter_table('request') as batch_op:
+        batch_op.create_index('ix_request_batch_id', ['batch_id'], unique=False)
+        batch_op.drop_index('ix_request_batch_id_id')
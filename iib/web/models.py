@@ -4,7 +4,19 @@ from copy import deepcopy
 from datetime import datetime, timedelta
 from enum import Enum
 import json
-from typing import Any, cast, Dict, List, Literal, Optional, Sequence, Set, Union
+from typing import (
+    Any,
+    cast,
+    Dict,
+    FrozenSet,
+    Iterable,
+    List,
+    Literal,
+    Optional,
+    Sequence,
+    Set,
+    Union,
+)
 from abc import abstractmethod
 
 from flask import current_app, url_for
@@ -12,7 +24,8 @@ from flask_login import UserMixin, current_user
 from flask_sqlalchemy.model import DefaultMeta
 import sqlalchemy
 from sqlalchemy.ext.declarative import declared_attr
-from sqlalchemy.orm import joinedload, load_only, validates
+from sqlalchemy.orm import joinedload, load_only, selectinload, validates
+from sqlalchemy.orm.util import AliasedClass
 from sqlalchemy.orm.strategy_options import _UnboundLoad
 from sqlalchemy.orm.relationships import RelationshipProperty
 from sqlalchemy.sql.schema import Column
@@ -61,6 +74,11 @@ class BaseEnum(Enum):
         return sorted([e.name for e in cls])
 
 
+# The states that are considered final for a request. This is defined outside of the
+# RequestStateMapping class since the class attributes of an Enum become its members.
+_FINAL_REQUEST_STATES = frozenset(('complete', 'failed'))
+
+
 class RequestStateMapping(BaseEnum):
     """An Enum that represents the request states."""
 
@@ -69,14 +87,14 @@ class RequestStateMapping(BaseEnum):
     failed: int = 3
 
     @staticmethod
-    def get_final_states() -> List[str]:
+    def get_final_states() -> FrozenSet[str]:
         """
         Get the states that are considered final for a request.
 
-        :return: a list of states
-        :rtype: list<str>
+        :return: a set of states
+        :rtype: frozenset<str>
         """
-        return ['complete', 'failed']
+        return _FINAL_REQUEST_STATES
 
     @classmethod
     def validate_state(cls, state: str) -> None:
@@ -86,9 +104,8 @@ class RequestStateMapping(BaseEnum):
         :param str state: the state to validate
         :raises iib.exceptions.ValidationError: if the state is invalid
         """
-        state_names = cls.get_names()
-        if state not in state_names:
-            states = ', '.join(state_names)
+        if state not in cls.__members__:
+            states = ', '.join(cls.get_names())
             raise ValidationError(
                 f'{state} is not a valid build request state. Valid states are: {states}'
             )
@@ -265,6 +282,38 @@ class Image(db.Model):
 
         return image
 
+    @classmethod
+    def bulk_get_or_create(cls, pull_specifications: Iterable[str]) -> Dict[str, Image]:
+        """
+        Get the images from the database in a single query and create the ones that don't exist.
+
+        :param iterable pull_specifications: pull_specifications of the images
+        :return: a dictionary mapping each pull_specification to its Image object; the Image
+            objects will be added to the database session, but not committed, if they were created
+        :rtype: dict
+        :raise ValidationError: if a pull_specification for an image is invalid
+        """
+        pull_specifications = set(pull_specifications)
+        for pull_specification in pull_specifications:
+            if '@' not in pull_specification and ':' not in pull_specification:
+                raise ValidationError(
+                    f'Image {pull_specification} should have a tag or a digest specified.'
+                )
+
+        if not pull_specifications:
+            return {}
+
+        images = {
+            image.pull_specification: image
+            for image in cls.query.filter(cls.pull_specification.in_(pull_specifications))
+        }
+        for pull_specification in pull_specifications - images.keys():
+            image = Image(pull_specification=pull_specification)
+            db.session.add(image)
+            images[pull_specification] = image
+
+        return images
+
 
 class Operator(db.Model):
     """An operator that has been handled by IIB."""
@@ -292,6 +341,28 @@ class Operator(db.Model):
 
         return operator
 
+    @classmethod
+    def bulk_get_or_create(cls, names: Iterable[str]) -> Dict[str, Operator]:
+        """
+        Get the operators from the database in a single query and create the ones that don't exist.
+
+        :param iterable names: the names of the operators
+        :return: a dictionary mapping each name to its Operator object; the Operator objects will
+            be added to the database session, but not committed, if they were created
+        :rtype: dict
+        """
+        names = set(names)
+        if not names:
+            return {}
+
+        operators = {operator.name: operator for operator in cls.query.filter(cls.name.in_(names))}
+        for name in names - operators.keys():
+            operator = Operator(name=name)
+            db.session.add(operator)
+            operators[name] = operator
+
+        return operators
+
 
 class BuildTag(db.Model):
     """Extra tag associated with built index image."""
@@ -359,7 +430,7 @@ class Request(db.Model):
     architectures = db.relationship(
         'Architecture', order_by='Architecture.name', secondary=RequestArchitecture.__table__
     )
-    batch_id = db.Column(db.Integer, db.ForeignKey('batch.id'), index=True, nullable=False)
+    batch_id = db.Column(db.Integer, db.ForeignKey('batch.id'), nullable=False)
     batch = db.relationship('Batch', back_populates='requests')
     request_state_id = db.Column(
         db.Integer, db.ForeignKey('request_state.id'), index=True, unique=True
@@ -380,6 +451,9 @@ class Request(db.Model):
         'BuildTag', order_by='BuildTag.name', secondary=RequestBuildTag.__table__
     )
 
+    # Allows filtering the requests by batch and ordering them by ID with a single index scan
+    __table_args__ = (db.Index('ix_request_batch_id_id', 'batch_id', 'id'),)
+
     __mapper_args__ = {
         'polymorphic_identity': RequestTypeMapping.__members__['generic'].value,
         'polymorphic_on': type,
@@ -412,7 +486,7 @@ class Request(db.Model):
         :raises ValidationError: if the state is invalid
         """
         try:
-            state_int = RequestStateMapping.__members__[state].value
+            state_int = RequestStateMapping[state].value
         except KeyError:
             raise ValidationError(
                 'The state "{}" is invalid. It must be one of: {}.'.format(
@@ -507,7 +581,7 @@ class Request(db.Model):
         rv = {
             'id': self.id,
             'arches': [arch.name for arch in self.architectures],
-            'batch': self.batch.id,
+            'batch': self.batch_id,
             'request_type': RequestTypeMapping.pretty(self.type),
             'user': getattr(self.user, 'username', None),
         }
@@ -567,8 +641,19 @@ class Request(db.Model):
         :return: temporary data expiration timestamp
         :rtype: str
         """
+        return self.get_temporary_data_expiration(self.state.updated)
+
+    @staticmethod
+    def get_temporary_data_expiration(state_updated: datetime) -> datetime:
+        """
+        Return the timestamp of when logs and related_bundles are considered expired.
+
+        :param datetime state_updated: the timestamp of the latest state of the request
+        :return: temporary data expiration timestamp
+        :rtype: datetime
+        """
         data_lifetime = timedelta(days=current_app.config['IIB_REQUEST_DATA_DAYS_TO_LIVE'])
-        return self.state.updated + data_lifetime
+        return state_updated + data_lifetime
 
 
 class Batch(db.Model):
@@ -716,52 +801,85 @@ class Batch(db.Model):
         return rv
 
 
-def get_request_query_options(verbose: Optional[bool] = False) -> List[_UnboundLoad]:
+def get_request_query_options(
+    poly_request: AliasedClass, verbose: Optional[bool] = False
+) -> List[_UnboundLoad]:
     """
     Get the query options for a SQLAlchemy query for one or more requests to output as JSON.
 
     This will add the joins ahead of time on relationships that are accessed in the ``to_json``
     methods to avoid individual select statements when the relationships are accessed.
 
+    :param AliasedClass poly_request: the ``with_polymorphic`` entity of ``Request`` to query
     :param bool verbose: if the request relationships should be loaded for verbose JSON output
     :return: a list of SQLAlchemy query options
     :rtype: list
     """
     # Tell SQLAlchemy to join on the relationships that are part of the JSON to avoid
-    # additional SQL queries
+    # additional SQL queries. The collections are loaded with separate queries so that they don't
+    # multiply the rows returned by the main query. The relationships of the subclasses must be
+    # accessed through the polymorphic entity for the options to apply to the query.
     query_options = [
-        joinedload(Request.user),
-        joinedload(RequestAdd.binary_image),
-        joinedload(RequestAdd.binary_image_resolved),
-        joinedload(RequestAdd.bundles),
-        joinedload(RequestAdd.from_index),
-        joinedload(RequestAdd.from_index_resolved),
-        joinedload(RequestAdd.index_image),
-        joinedload(RequestAdd.index_image_resolved),
-        joinedload(RequestAdd.internal_index_image_copy),
-        joinedload(RequestAdd.internal_index_image_copy_resolved),
-        joinedload(RequestAdd.build_tags),
-        joinedload(RequestRegenerateBundle.bundle_image),
-        joinedload(RequestRegenerateBundle.from_bundle_image),
-        joinedload(RequestRegenerateBundle.from_bundle_image_resolved),
-        joinedload(RequestRm.binary_image),
-        joinedload(RequestRm.binary_image_resolved),
-        joinedload(RequestRm.from_index),
-        joinedload(RequestRm.from_index_resolved),
-        joinedload(RequestRm.index_image),
-        joinedload(RequestRm.index_image_resolved),
-        joinedload(RequestRm.internal_index_image_copy),
-        joinedload(RequestRm.internal_index_image_copy_resolved),
-        joinedload(RequestRm.operators),
-        joinedload(RequestRm.build_tags),
-        joinedload(RequestMergeIndexImage.build_tags),
-        joinedload(RequestFbcOperations.fbc_fragment),
-        joinedload(RequestFbcOperations.fbc_fragment_resolved),
+        joinedload(poly_request.state),
+        joinedload(poly_request.user),
+        selectinload(poly_request.architectures),
+        joinedload(poly_request.RequestAdd.binary_image),
+        joinedload(poly_request.RequestAdd.binary_image_resolved),
+        selectinload(poly_request.RequestAdd.bundles).joinedload(Image.operator),
+        selectinload(poly_request.RequestAdd.deprecation_list),
+        joinedload(poly_request.RequestAdd.from_index),
+        joinedload(poly_request.RequestAdd.from_index_resolved),
+        joinedload(poly_request.RequestAdd.index_image),
+        joinedload(poly_request.RequestAdd.index_image_resolved),
+        joinedload(poly_request.RequestAdd.internal_index_image_copy),
+        joinedload(poly_request.RequestAdd.internal_index_image_copy_resolved),
+        selectinload(poly_request.RequestAdd.build_tags),
+        joinedload(poly_request.RequestRegenerateBundle.bundle_image),
+        joinedload(poly_request.RequestRegenerateBundle.from_bundle_image),
+        joinedload(poly_request.RequestRegenerateBundle.from_bundle_image_resolved),
+        joinedload(poly_request.RequestRm.binary_image),
+        joinedload(poly_request.RequestRm.binary_image_resolved),
+        joinedload(poly_request.RequestRm.from_index),
+        joinedload(poly_request.RequestRm.from_index_resolved),
+        joinedload(poly_request.RequestRm.index_image),
+        joinedload(poly_request.RequestRm.index_image_resolved),
+        joinedload(poly_request.RequestRm.internal_index_image_copy),
+        joinedload(poly_request.RequestRm.internal_index_image_copy_resolved),
+        selectinload(poly_request.RequestRm.operators),
+        selectinload(poly_request.RequestRm.build_tags),
+        joinedload(poly_request.RequestMergeIndexImage.binary_image),
+        joinedload(poly_request.RequestMergeIndexImage.binary_image_resolved),
+        selectinload(poly_request.RequestMergeIndexImage.deprecation_list),
+        joinedload(poly_request.RequestMergeIndexImage.index_image),
+        joinedload(poly_request.RequestMergeIndexImage.source_from_index),
+        joinedload(poly_request.RequestMergeIndexImage.source_from_index_resolved),
+        joinedload(poly_request.RequestMergeIndexImage.target_index),
+        joinedload(poly_request.RequestMergeIndexImage.target_index_resolved),
+        selectinload(poly_request.RequestMergeIndexImage.build_tags),
+        joinedload(poly_request.RequestCreateEmptyIndex.binary_image),
+        joinedload(poly_request.RequestCreateEmptyIndex.binary_image_resolved),
+        joinedload(poly_request.RequestCreateEmptyIndex.from_index),
+        joinedload(poly_request.RequestCreateEmptyIndex.from_index_resolved),
+        joinedload(poly_request.RequestCreateEmptyIndex.index_image),
+        joinedload(poly_request.RequestCreateEmptyIndex.index_image_resolved),
+        joinedload(poly_request.RequestRecursiveRelatedBundles.parent_bundle_image),
+        joinedload(poly_request.RequestRecursiveRelatedBundles.parent_bundle_image_resolved),
+        joinedload(poly_request.RequestFbcOperations.binary_image),
+        joinedload(poly_request.RequestFbcOperations.binary_image_resolved),
+        joinedload(poly_request.RequestFbcOperations.fbc_fragment),
+        joinedload(poly_request.RequestFbcOperations.fbc_fragment_resolved),
+        joinedload(poly_request.RequestFbcOperations.from_index),
+        joinedload(poly_request.RequestFbcOperations.from_index_resolved),
+        joinedload(poly_request.RequestFbcOperations.index_image),
+        joinedload(poly_request.RequestFbcOperations.index_image_resolved),
+        joinedload(poly_request.RequestFbcOperations.internal_index_image_copy),
+        joinedload(poly_request.RequestFbcOperations.internal_index_image_copy_resolved),
+        selectinload(poly_request.RequestFbcOperations.build_tags),
     ]
+    # The batch is only needed for its annotations in the verbose JSON. Otherwise, the batch ID is
+    # read from the request itself, so the batch doesn't need to be loaded.
     if verbose:
-        query_options.append(joinedload(Request.states))
-    else:
-        query_options.append(joinedload(Request.state))
+        query_options.extend([joinedload(poly_request.batch), selectinload(poly_request.states)])
 
     return query_options
 
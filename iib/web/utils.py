@@ -1,15 +1,24 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
-from flask import request, url_for
-from flask_sqlalchemy import Pagination
-from typing import Optional
+from collections import OrderedDict
+import re
+import threading
 
-from iib.web.iib_static_types import PaginationMetadata
+from flask import abort, request, url_for
+from flask.json import JSONEncoder
+from flask_sqlalchemy import BaseQuery, Pagination
+import orjson
+from typing import Any, Hashable, List, Match, Optional, Sequence
+
+from iib.web.iib_static_types import KeysetPaginationMetadata, PaginationMetadata
 
 
 def pagination_metadata(pagination_query: Pagination, **kwargs) -> PaginationMetadata:
     """
     Return a dictionary containing metadata about the paginated query.
 
+    If the total number of items of the query was not counted, the ``last``, ``pages`` and
+    ``total`` keys are omitted.
+
     This must be run as part of a Flask request.
 
     :param flask_sqlalchemy.Pagination pagination_query: the paginated query
@@ -24,21 +33,23 @@ def pagination_metadata(pagination_query: Pagination, **kwargs) -> PaginationMet
             _external=True,
             **kwargs,
         ),
-        'last': url_for(
-            str(request.endpoint),
-            page=pagination_query.pages,
-            per_page=pagination_query.per_page,
-            _external=True,
-            **kwargs,
-        ),
         'next': None,
         'page': pagination_query.page,
-        'pages': pagination_query.pages,
         'per_page': pagination_query.per_page,
         'previous': None,
-        'total': pagination_query.total,
     }
 
+    if pagination_query.total is not None:
+        pagination_data['last'] = url_for(
+            str(request.endpoint),
+            page=pagination_query.pages,
+            per_page=pagination_query.per_page,
+            _external=True,
+            **kwargs,
+        )
+        pagination_data['pages'] = pagination_query.pages
+        pagination_data['total'] = pagination_query.total
+
     if pagination_query.has_prev:
         pagination_data['previous'] = url_for(
             str(request.endpoint),
@@ -59,6 +70,99 @@ def pagination_metadata(pagination_query: Pagination, **kwargs) -> PaginationMet
     return pagination_data
 
 
+class UncountedPagination(Pagination):
+    """A page of the results of a query for which the total number of items was not counted."""
+
+    def __init__(
+        self, query: BaseQuery, page: int, per_page: int, items: List[Any], has_next: bool
+    ) -> None:
+        """
+        Initialize the pagination.
+
+        :param flask_sqlalchemy.BaseQuery query: the paginated query
+        :param int page: the number of the current page
+        :param int per_page: the maximum number of items per page
+        :param list items: the items on the current page
+        :param bool has_next: if there are more items after the current page
+        """
+        super().__init__(query, page, per_page, None, items)
+        self._has_next = has_next
+
+    @property
+    def has_next(self) -> bool:
+        """Return True if a next page exists."""
+        return self._has_next
+
+
+def paginate_without_count(query: BaseQuery, max_per_page: int) -> UncountedPagination:
+    """
+    Paginate the query without counting the total number of items.
+
+    This behaves like ``BaseQuery.paginate`` but avoids the extra ``COUNT`` query by fetching one
+    more item than needed to know if there is a next page.
+
+    This must be run as part of a Flask request.
+
+    :param flask_sqlalchemy.BaseQuery query: the query to paginate
+    :param int max_per_page: the maximum number of items per page
+    :return: the page of the query requested by the ``page`` and ``per_page`` query parameters
+    :rtype: UncountedPagination
+    :raise NotFound: if the query parameters are invalid or the page doesn't exist
+    """
+    try:
+        page = int(request.args.get('page', 1))
+        # Use the default of BaseQuery.paginate, so that the page size doesn't depend on counting
+        per_page = int(request.args.get('per_page', 20))
+    except ValueError:
+        abort(404)
+
+    per_page = min(per_page, max_per_page)
+    # An empty page would always have a next page, so it is rejected
+    if page < 1 or per_page < 1:
+        abort(404)
+
+    items = query.limit(per_page + 1).offset((page - 1) * per_page).all()
+    if not items and page != 1:
+        abort(404)
+
+    return UncountedPagination(query, page, per_page, items[:per_page], len(items) > per_page)
+
+
+def keyset_pagination_metadata(
+    items: Sequence[Any], per_page: int, has_next: bool, **kwargs
+) -> KeysetPaginationMetadata:
+    """
+    Return a dictionary containing metadata about the keyset paginated query.
+
+    The items are expected to be ordered by descending ID. The link to the next page points to the
+    items with an ID lower than the ID of the last item.
+
+    This must be run as part of a Flask request.
+
+    :param list items: the items on the current page
+    :param int per_page: the maximum number of items per page
+    :param bool has_next: if there are more items after the current page
+    :param dict kwargs: the query parameters to add to the URLs
+    :return: a dictionary containing metadata about the keyset paginated query
+    """
+    pagination_data: KeysetPaginationMetadata = {
+        'first': url_for(str(request.endpoint), per_page=per_page, _external=True, **kwargs),
+        'next': None,
+        'per_page': per_page,
+    }
+
+    if has_next and items:
+        pagination_data['next'] = url_for(
+            str(request.endpoint),
+            before=items[-1].id,
+            per_page=per_page,
+            _external=True,
+            **kwargs,
+        )
+
+    return pagination_data
+
+
 def str_to_bool(item: Optional[str]) -> bool:
     """
     Convert a string to a boolean.
@@ -71,3 +175,118 @@ def str_to_bool(item: Optional[str]) -> bool:
         return item.lower() in ('true', '1')
     else:
         return False
+
+
+_NON_ASCII_RE = re.compile(r'[^\x00-\x7f]')
+
+
+def _escape_non_ascii(match: Match[str]) -> str:
+    """
+    Return the JSON escape sequence of a non-ASCII character like the standard library encoder.
+
+    :param re.Match match: the match of the non-ASCII character
+    :return: the escape sequence, using a surrogate pair for characters outside of the BMP
+    :rtype: str
+    """
+    code_point = ord(match.group())
+    if code_point < 0x10000:
+        return f'\\u{code_point:04x}'
+    code_point -= 0x10000
+    high = 0xD800 | (code_point >> 10)
+    low = 0xDC00 | (code_point & 0x3FF)
+    return f'\\u{high:04x}\\u{low:04x}'
+
+
+class IIBJSONEncoder(JSONEncoder):
+    """
+    A Flask JSON encoder which serializes the data with orjson.
+
+    orjson serializes the data in C, which is considerably faster than the standard library
+    encoder used by Flask for large responses such as the paginated list of builds. The
+    ``default`` method of Flask's encoder is still used for types not natively supported by
+    orjson, and non-ASCII characters are escaped unless ``ensure_ascii`` is false. The data that
+    orjson can't serialize falls back to Flask's encoder.
+    """
+
+    def encode(self, o: Any) -> str:
+        """
+        Return the JSON string representation of ``o``.
+
+        :param o: the object to serialize
+        :return: the JSON string
+        :rtype: str
+        """
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if self.indent:
+            option |= orjson.OPT_INDENT_2
+        try:
+            rv = orjson.dumps(o, default=self.default, option=option).decode('utf-8')
+        except TypeError:
+            # orjson rejects some valid input, such as integers exceeding 64 bits and lone
+            # surrogates, which can be part of the arbitrary JSON submitted by clients
+            return super().encode(o)
+        # orjson always outputs UTF-8, so escape the non-ASCII characters like the standard library
+        # encoder does when ensure_ascii is set, which is the default of Flask
+        if self.ensure_ascii and not rv.isascii():
+            rv = _NON_ASCII_RE.sub(_escape_non_ascii, rv)
+        return rv
+
+
+class LRUCache:
+    """
+    A thread-safe in-memory cache which evicts the least recently used entries when full.
+
+    Unlike ``functools.lru_cache``, entries can be invalidated individually.
+    """
+
+    def __init__(self, maxsize: int) -> None:
+        """
+        Initialize the cache.
+
+        :param int maxsize: the maximum number of entries to keep in the cache
+        """
+        self.maxsize = maxsize
+        self._data: OrderedDict[Hashable, Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any:
+        """
+        Return the cached value of ``key`` and mark it as recently used.
+
+        :param key: the key of the entry
+        :return: the cached value or None if the key is not in the cache
+        """
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """
+        Cache ``value`` for ``key``, evicting the least recently used entry if the cache is full.
+
+        :param key: the key of the entry
+        :param value: the value to cache
+        """
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        """
+        Remove the entry of ``key`` from the cache if it is present.
+
+        :param key: the key of the entry
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        """Remove all the entries from the cache."""
+        with self._lock:
+            self._data.clear()
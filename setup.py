@@ -17,6 +17,7 @@ setup(
         'flask-migrate',
         'flask-sqlalchemy',
         'operator-manifest',
+        'orjson',
         'psycopg2-binary',
         'python-memcached ',
         'python-qpid-proton',
@@ -5,10 +5,19 @@ from unittest import mock
 from botocore.response import StreamingBody
 from io import StringIO
 import pytest
+from sqlalchemy import event
 from sqlalchemy.exc import DisconnectionError
 
-from iib.web.api_v1 import _get_unique_bundles
-from iib.web.models import Image, RequestAdd, RequestRm, RequestCreateEmptyIndex
+from iib.web.api_v1 import _finalized_request_cache, _get_unique_bundles, _mask_args
+from iib.web.models import Image, Operator, RequestAdd, RequestRm, RequestCreateEmptyIndex
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    # The request IDs are reused between tests, so the caches must not leak between them
+    _finalized_request_cache.clear()
+    with mock.patch('iib.web.api_v1._last_successful_healthcheck', float('-inf')):
+        yield
 
 
 def test_get_build(app, auth_env, client, db):
@@ -160,6 +169,192 @@ def test_get_builds(app, auth_env, client, db):
     assert rv_json['items'][0]['user'] == 'tbrady@DOMAIN.LOCAL'
 
 
+def test_get_builds_keyset_pagination(app, auth_env, client, db):
+    # flask_login.current_user is used in RequestAdd.from_json, which requires a request context
+    with app.test_request_context(environ_base=auth_env):
+        for i in range(30):
+            data = {
+                'binary_image': 'quay.io/namespace/binary_image:latest',
+                'bundles': [f'quay.io/namespace/bundle:{i}'],
+                'from_index': f'quay.io/namespace/repo:{i}',
+            }
+            request = RequestAdd.from_json(data)
+            if i % 2 == 0:
+                request.add_state('failed', 'Failed due to an unknown error')
+            db.session.add(request)
+        db.session.commit()
+
+    rv_json = client.get('/api/v1/builds?before=25&per_page=10').json
+    assert [item['id'] for item in rv_json['items']] == list(range(24, 14, -1))
+    assert rv_json['meta']['per_page'] == 10
+    assert 'before' not in rv_json['meta']['first']
+    assert 'before=15' in rv_json['meta']['next']
+
+    rv_json = client.get('/api/v1/builds?before=15&per_page=10').json
+    assert [item['id'] for item in rv_json['items']] == list(range(14, 4, -1))
+    rv_json = client.get('/api/v1/builds?before=5&per_page=10').json
+    assert [item['id'] for item in rv_json['items']] == [4, 3, 2, 1]
+    assert rv_json['meta']['next'] is None
+
+    rv_json = client.get('/api/v1/builds?before=10&state=failed').json
+    assert [item['id'] for item in rv_json['items']] == [9, 7, 5, 3, 1]
+    assert rv_json['meta']['per_page'] == app.config['IIB_MAX_PER_PAGE']
+    assert 'state=failed' in rv_json['meta']['first']
+    assert rv_json['meta']['next'] is None
+
+
+@pytest.mark.parametrize('query', ('before=0', 'before=abc', 'before=5&per_page=-1'))
+def test_get_builds_keyset_pagination_invalid(query, app, client, db):
+    rv = client.get(f'/api/v1/builds?{query}')
+    assert rv.status_code == 400
+    assert rv.json == {'error': 'The "before" and "per_page" parameters must be positive integers'}
+
+
+def test_get_builds_without_count(app, auth_env, client, db):
+    # flask_login.current_user is used in RequestAdd.from_json, which requires a request context
+    with app.test_request_context(environ_base=auth_env):
+        for i in range(25):
+            data = {
+                'binary_image': 'quay.io/namespace/binary_image:latest',
+                'bundles': [f'quay.io/namespace/bundle:{i}'],
+                'from_index': f'quay.io/namespace/repo:{i}',
+            }
+            request = RequestAdd.from_json(data)
+            db.session.add(request)
+        db.session.commit()
+
+    rv_json = client.get('/api/v1/builds?count=false&per_page=10').json
+    assert [item['id'] for item in rv_json['items']] == list(range(25, 15, -1))
+    assert rv_json['meta'].keys() == {'first', 'next', 'page', 'per_page', 'previous'}
+    assert rv_json['meta']['previous'] is None
+    assert 'page=2' in rv_json['meta']['next']
+    assert 'count=false' in rv_json['meta']['next']
+
+    rv_json = client.get('/api/v1/builds?count=false&per_page=10&page=3').json
+    assert [item['id'] for item in rv_json['items']] == list(range(5, 0, -1))
+    assert 'page=2' in rv_json['meta']['previous']
+    assert rv_json['meta']['next'] is None
+
+    rv = client.get('/api/v1/builds?count=false&per_page=10&page=4')
+    assert rv.status_code == 404
+
+    rv = client.get('/api/v1/builds?count=false&per_page=0')
+    assert rv.status_code == 404
+
+    # The page size must not depend on whether the total is counted
+    app.config['IIB_MAX_PER_PAGE'] = 50
+    rv_json = client.get('/api/v1/builds?count=false').json
+    assert rv_json['meta']['per_page'] == client.get('/api/v1/builds').json['meta']['per_page']
+
+    rv_json = client.get('/api/v1/builds?per_page=10').json
+    assert rv_json['meta']['total'] == 25
+    assert rv_json['meta']['pages'] == 3
+    assert 'page=3' in rv_json['meta']['last']
+
+
+@pytest.mark.parametrize('chunk_size', (100, 3))
+def test_get_builds_stream(app, auth_env, client, db, chunk_size):
+    # flask_login.current_user is used in RequestAdd.from_json, which requires a request context
+    with app.test_request_context(environ_base=auth_env):
+        for i in range(10):
+            data = {
+                'binary_image': 'quay.io/namespace/binary_image:latest',
+                'bundles': [f'quay.io/namespace/bundle:{i}'],
+                'from_index': f'quay.io/namespace/repo:{i}',
+            }
+            request = RequestAdd.from_json(data)
+            if i % 2 == 0:
+                request.add_state('failed', 'Failed due to an unknown error')
+            db.session.add(request)
+        db.session.commit()
+
+    # The stream is not limited by the page size, but by its own maximum
+    app.config['IIB_MAX_PER_PAGE'] = 3
+    app.config['IIB_MAX_STREAMED_REQUESTS'] = 8
+    with mock.patch('iib.web.api_v1._STREAM_CHUNK_SIZE', chunk_size):
+        rv = client.get('/api/v1/builds?stream=true')
+        all_lines = rv.get_data(as_text=True).splitlines()
+        rv = client.get('/api/v1/builds?stream=true&per_page=100')
+        capped_lines = rv.get_data(as_text=True).splitlines()
+        rv = client.get('/api/v1/builds?stream=true&per_page=2', buffered=False)
+        assert rv.status_code == 200
+        assert rv.mimetype == 'application/x-ndjson'
+        assert rv.is_streamed
+        lines = rv.get_data(as_text=True).splitlines()
+        rv = client.get('/api/v1/builds?stream=true&per_page=5&before=9')
+        before_lines = rv.get_data(as_text=True).splitlines()
+        rv = client.get('/api/v1/builds?stream=true&before=2')
+        last_lines = rv.get_data(as_text=True).splitlines()
+        rv = client.get('/api/v1/builds?stream=true&state=failed&verbose=true')
+        failed_lines = rv.get_data(as_text=True).splitlines()
+
+    assert [json.loads(line)['id'] for line in all_lines] == list(range(10, 2, -1))
+    assert capped_lines == all_lines
+    assert [json.loads(line)['id'] for line in lines] == [10, 9]
+    assert [json.loads(line)['id'] for line in before_lines] == [8, 7, 6, 5, 4]
+    assert [json.loads(line)['id'] for line in last_lines] == [1]
+    failed_requests = [json.loads(line) for line in failed_lines]
+    assert [request['id'] for request in failed_requests] == [9, 7, 5, 3, 1]
+    assert all('state_history' in request for request in failed_requests)
+
+
+@pytest.mark.parametrize('verbose', (True, False))
+def test_get_builds_query_count(app, auth_env, client, db, verbose):
+    # flask_login.current_user is used in RequestAdd.from_json, which requires a request context
+    with app.test_request_context(environ_base=auth_env):
+        for i in range(20):
+            data = {
+                'add_arches': ['amd64', 's390x'],
+                'binary_image': 'quay.io/namespace/binary_image:latest',
+                'bundles': [f'quay.io/namespace/bundle{j}:{i}' for j in range(3)],
+                'deprecation_list': [f'quay.io/namespace/bundle{j}:{i}' for j in range(3)],
+                'from_index': f'quay.io/namespace/repo:{i}',
+                'build_tags': [f'tag-{i}-{j}' for j in range(3)],
+            }
+            request = RequestAdd.from_json(data)
+            for bundle in request.bundles:
+                bundle.operator = Operator.get_or_create(f'operator-{i}')
+            request.add_architecture('amd64')
+            db.session.add(request)
+            data = {
+                'binary_image': 'quay.io/namespace/binary_image:latest',
+                'from_index': f'quay.io/namespace/repo:{i}',
+                'operators': [f'operator-{i}'],
+            }
+            db.session.add(RequestRm.from_json(data))
+        db.session.commit()
+
+    statements = []
+
+    def _count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', _count_statement)
+    try:
+        client.get(f'/api/v1/builds?per_page=2&verbose={verbose}')
+        small_page_count = len(statements)
+        statements.clear()
+        client.get(f'/api/v1/builds?page=2&per_page=10&verbose={verbose}')
+        offset_statements = [statement for statement, _ in statements if 'OFFSET' in statement]
+        statements.clear()
+        client.get(f'/api/v1/builds?per_page=20&verbose={verbose}')
+        large_page_count = len(statements)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', _count_statement)
+
+    # The number of queries must not depend on the number of requests on the page
+    assert small_page_count == large_page_count
+    # The collections are loaded by the IDs of the requests, so the offset is only scanned once
+    assert len(offset_statements) == 1
+    # The batch annotations are only part of the verbose JSON
+    assert any('annotations' in statement for statement, _ in statements) is verbose
+    # The largest collection on the page has 3 bundles for each of the 10 add requests. No query
+    # may return more rows than that, which would mean that collections multiply each other's rows.
+    for statement, parameters in statements:
+        row_count = db.engine.execute(f'SELECT COUNT(*) FROM ({statement})', parameters).scalar()
+        assert row_count <= 30, statement
+
+
 def test_index_image_filter(app, client, db, minimal_request_add, minimal_request_rm):
     minimal_request_add.add_state('in_progress', 'Starting things up!')
     minimal_request_add.index_image = Image.get_or_create('quay.io/namespace/index@sha256:fghijk')
@@ -210,9 +405,9 @@ def test_get_builds_invalid_batch(batch, app, client, db):
     assert rv.json == {'error': 'The batch must be a positive integer'}
 
 
-@mock.patch('sqlalchemy.engine.base.Engine.execute')
-def test_get_healthcheck_db_fail(mock_db_execute, app, client, db):
-    mock_db_execute.side_effect = DisconnectionError('DB failed')
+@mock.patch('sqlalchemy.engine.base.Connection.scalar')
+def test_get_healthcheck_db_fail(mock_db_scalar, app, client, db):
+    mock_db_scalar.side_effect = DisconnectionError('DB failed')
     rv = client.get('/api/v1/healthcheck')
     assert rv.status_code == 500
     assert rv.json == {'error': 'Database health check failed.'}
@@ -224,6 +419,26 @@ def test_get_healthcheck_ok(app, client, db):
     assert rv.json == {'status': 'Health check OK'}
 
 
+@mock.patch('iib.web.api_v1.time.monotonic')
+def test_get_healthcheck_cached(mock_monotonic, app, client, db):
+    mock_monotonic.return_value = 100.0
+    rv = client.get('/api/v1/healthcheck')
+    assert rv.status_code == 200
+
+    with mock.patch('sqlalchemy.engine.base.Connection.scalar') as mock_db_scalar:
+        mock_db_scalar.side_effect = DisconnectionError('DB failed')
+        # The successful health check is reused within a second
+        mock_monotonic.return_value = 100.5
+        rv = client.get('/api/v1/healthcheck')
+        assert rv.status_code == 200
+        mock_db_scalar.assert_not_called()
+
+        mock_monotonic.return_value = 101.0
+        rv = client.get('/api/v1/healthcheck')
+        assert rv.status_code == 500
+        mock_db_scalar.assert_called_once()
+
+
 @pytest.mark.parametrize(
     ("bundles", "exp_bundles"),
     (([1, 2, 3, 4], [1, 2, 3, 4]), ([], []), ([1, 2, 1, 3, 1, 4, 3], [1, 2, 3, 4])),
@@ -233,6 +448,20 @@ def test_get_unique_bundles(bundles, exp_bundles, app):
     assert tmp_uniq == exp_bundles
 
 
+@pytest.mark.parametrize(
+    ('args', 'positions', 'expected'),
+    (
+        (['secret', 'secret', None], (1, 2), ['secret', '*****', None]),
+        (['operator', None, 'token'], (2,), ['operator', None, '*****']),
+        (['operator', None, None], (1, 2), ['operator', None, None]),
+    ),
+)
+def test_mask_args(args, positions, expected):
+    assert _mask_args(args, positions) == expected
+    # The original arguments must not be modified
+    assert args[positions[-1]] != '*****'
+
+
 @pytest.mark.parametrize(
     ('logs_content', 'expired', 'finalized', 'expected'),
     (
@@ -284,6 +513,77 @@ def test_get_build_logs(
         assert rv.json == expected['json']
 
 
+def test_get_build_logs_streamed(client, db, minimal_request_add, tmpdir):
+    minimal_request_add.add_state('complete', 'The request is complete')
+    db.session.commit()
+
+    client.application.config['IIB_REQUEST_LOGS_DIR'] = str(tmpdir)
+    request_id = minimal_request_add.id
+    # Make the logs span multiple chunks
+    logs_content = 'a line of the logs\n' * 10000
+    tmpdir.join(f'{request_id}.log').write(logs_content)
+    rv = client.get(f'/api/v1/builds/{request_id}/logs', buffered=False)
+    assert rv.status_code == 200
+    assert rv.is_streamed
+    assert rv.headers['Content-Length'] == str(len(logs_content))
+    assert rv.get_data(as_text=True) == logs_content
+
+
+@mock.patch('iib.web.api_v1.messaging.send_message_for_state_change')
+def test_get_build_logs_cached(
+    mock_smfsc, client, db, minimal_request_add, tmpdir, worker_auth_env
+):
+    minimal_request_add.add_state('complete', 'The request is complete')
+    db.session.commit()
+
+    client.application.config['IIB_REQUEST_LOGS_DIR'] = str(tmpdir)
+    request_id = minimal_request_add.id
+    tmpdir.join(f'{request_id}.log').write('foobar')
+    rv = client.get(f'/api/v1/builds/{request_id}/logs')
+    assert rv.status_code == 200
+
+    statements = []
+
+    def _count_statement(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', _count_statement)
+    try:
+        rv = client.get(f'/api/v1/builds/{request_id}/logs')
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', _count_statement)
+
+    assert rv.status_code == 200
+    assert rv.data == b'foobar'
+    # The state of the finalized request is cached after the logs are first retrieved
+    assert statements == []
+
+    # Updating the state reason extends the expiration of the logs, so it must not be cached
+    rv = client.patch(
+        f'/api/v1/builds/{request_id}',
+        json={'state': 'complete', 'state_reason': 'The request is really complete'},
+        environ_base=worker_auth_env,
+    )
+    assert rv.status_code == 200
+    assert _finalized_request_cache.get(request_id) is None
+
+
+@pytest.mark.parametrize('prefix', ('/request-logs', '/request-logs/'))
+def test_get_build_logs_xsendfile(client, db, minimal_request_add, tmpdir, prefix):
+    minimal_request_add.add_state('complete', 'The request is complete')
+    db.session.commit()
+
+    client.application.config['IIB_REQUEST_LOGS_DIR'] = str(tmpdir)
+    client.application.config['IIB_LOG_XSENDFILE_PREFIX'] = prefix
+    request_id = minimal_request_add.id
+    tmpdir.join(f'{request_id}.log').write('foobar')
+    rv = client.get(f'/api/v1/builds/{request_id}/logs')
+    assert rv.status_code == 200
+    assert rv.mimetype == 'text/plain'
+    assert rv.headers['X-Accel-Redirect'] == f'/request-logs/{request_id}.log'
+    assert rv.data == b''
+
+
 def test_get_build_logs_not_configured(client, db, minimal_request_add):
     minimal_request_add.add_state('complete', 'Wrapping things up!')
     db.session.commit()
@@ -1519,12 +1819,14 @@ def test_regenerate_bundle_batch_success(
                 ),
                 link_error=mock.ANY,
                 queue=expected_queue,
+                producer=mock.ANY,
             ),
             mock.call(
                 args=['registry.example.com/bundle-image2:latest', None, 2, None, None],
                 argsrepr="['registry.example.com/bundle-image2:latest', None, 2, None, None]",
                 link_error=mock.ANY,
                 queue=expected_queue,
+                producer=mock.ANY,
             ),
         )
     )
@@ -1648,6 +1950,7 @@ def test_add_rm_batch_success(mock_smfnbor, mock_hrr, mock_har, app, auth_env, c
                 ),
                 link_error=mock.ANY,
                 queue=None,
+                producer=mock.ANY,
             ),
         )
     )
@@ -1673,6 +1976,7 @@ def test_add_rm_batch_success(mock_smfnbor, mock_hrr, mock_har, app, auth_env, c
                 ),
                 link_error=mock.ANY,
                 queue=None,
+                producer=mock.ANY,
             ),
         )
     )
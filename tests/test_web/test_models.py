@@ -75,10 +75,55 @@ def test_request_temporary_data_expiration(app, db, minimal_request):
     assert minimal_request.temporary_data_expiration == (updated + timedelta(days=99))
 
 
+def test_image_bulk_get_or_create(db):
+    existing_image = models.Image.get_or_create('quay.io/ns/existing:v1')
+    db.session.commit()
+
+    images = models.Image.bulk_get_or_create(
+        ['quay.io/ns/existing:v1', 'quay.io/ns/new@sha256:123456', 'quay.io/ns/new@sha256:123456']
+    )
+    assert images.keys() == {'quay.io/ns/existing:v1', 'quay.io/ns/new@sha256:123456'}
+    assert images['quay.io/ns/existing:v1'] is existing_image
+    db.session.commit()
+    assert models.Image.query.count() == 2
+
+
+def test_image_bulk_get_or_create_invalid(db):
+    with pytest.raises(ValidationError, match='Image quay.io/ns/image should have a tag'):
+        models.Image.bulk_get_or_create(['quay.io/ns/image:v1', 'quay.io/ns/image'])
+
+
+def test_operator_bulk_get_or_create(db):
+    existing_operator = models.Operator.get_or_create('existing-operator')
+    db.session.commit()
+
+    operators = models.Operator.bulk_get_or_create(['existing-operator', 'new-operator'])
+    assert operators.keys() == {'existing-operator', 'new-operator'}
+    assert operators['existing-operator'] is existing_operator
+    db.session.commit()
+    assert models.Operator.query.count() == 2
+    assert models.Operator.bulk_get_or_create([]) == {}
+
+
 def test_get_state_names():
     assert models.RequestStateMapping.get_names() == ['complete', 'failed', 'in_progress']
 
 
+def test_get_final_states():
+    assert models.RequestStateMapping.get_final_states() == {'complete', 'failed'}
+
+
+@pytest.mark.parametrize('state', ('complete', 'failed', 'in_progress'))
+def test_validate_state(state):
+    models.RequestStateMapping.validate_state(state)
+
+
+def test_validate_state_invalid():
+    expected = 'unknown is not a valid build request state. Valid states are: complete, failed, in_'
+    with pytest.raises(ValidationError, match=expected):
+        models.RequestStateMapping.validate_state('unknown')
+
+
 def test_get_type_names():
     assert models.RequestTypeMapping.get_names() == [
         'add',
@@ -0,0 +1,49 @@
+# SPDX-License-Identifier: GPL-3.0-or-later
+import json
+
+import flask
+import pytest
+
+from iib.web.utils import IIBJSONEncoder, LRUCache
+
+
+def test_iib_json_encoder(app):
+    assert app.json_encoder is IIBJSONEncoder
+
+    data = {'b': [1, 2], 'a': {1: 'one'}, 'c': None}
+    rv = flask.json.dumps(data, sort_keys=True)
+    assert rv == '{"a":{"1":"one"},"b":[1,2],"c":null}'
+
+    rv = flask.json.dumps(data, indent=2)
+    assert flask.json.loads(rv) == {'b': [1, 2], 'a': {'1': 'one'}, 'c': None}
+    assert '\n  "b"' in rv
+
+    data = {'name': 'caf\u00e9 \U0001f600', 'a': 'ascii'}
+    assert flask.json.dumps(data) == json.dumps(data, separators=(',', ':'))
+    assert flask.json.dumps(data, ensure_ascii=False) == json.dumps(
+        data, ensure_ascii=False, separators=(',', ':')
+    )
+
+
+@pytest.mark.parametrize('data', ({'n': 2**70}, {'s': '\ud800'}))
+def test_iib_json_encoder_unsupported_by_orjson(app, data):
+    assert flask.json.loads(flask.json.dumps(data)) == data
+
+
+def test_lru_cache():
+    cache = LRUCache(maxsize=2)
+    cache.set(1, 'one')
+    cache.set(2, 'two')
+    assert cache.get(1) == 'one'
+    # The least recently used entry is evicted when the cache is full
+    cache.set(3, 'three')
+    assert cache.get(2) is None
+    assert cache.get(1) == 'one'
+    assert cache.get(3) == 'three'
+
+    cache.pop(1)
+    cache.pop(2)
+    assert cache.get(1) is None
+
+    cache.clear()
+    assert cache.get(3) is None